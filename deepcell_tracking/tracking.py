@@ -40,7 +40,6 @@ import timeit
 
 import numpy as np
 from scipy.optimize import linear_sum_assignment
-from scipy.spatial.distance import cdist
 from skimage.measure import regionprops
 
 import networkx as nx
@@ -50,6 +49,7 @@ from deepcell_tracking.utils import clean_up_annotations
 from deepcell_tracking.utils import get_max_cells
 from deepcell_tracking.utils import normalize_adj_matrix
 from deepcell_tracking.utils import get_image_features
+from deepcell_tracking.utils import get_adjacency_matrix
 from deepcell_tracking.utils import save_trk
 
 
@@ -182,7 +182,7 @@ class CellTracker(object):  # pylint: disable=useless-object-inheritance
             list: All cell labels in the frame.
         """
         cells = np.unique(self._get_frame(self.y, frame))
-        cells = np.delete(cells, np.where(cells == 0))  # remove the background
+        cells = cells[cells != 0]  # remove the background
         return list(cells)
 
     def _est_feats(self):
@@ -222,9 +222,8 @@ class CellTracker(object):  # pylint: disable=useless-object-inheritance
             morphologies[frame, :num_tracks] = frame_features['morphologies']
             appearances[frame, :num_tracks] = frame_features['appearances']
 
-            cent = centroids[frame]
-            distance = cdist(cent, cent, metric='euclidean') < self.distance_threshold
-            adj_matrix[frame] = distance.astype('float32')
+            adj_matrix[frame] = get_adjacency_matrix(
+                centroids[frame], self.distance_threshold)
 
         # Normalize adj matrix
         norm_adj_matrices = normalize_adj_matrix(adj_matrix)
@@ -34,20 +34,169 @@ import json
 import os
 import re
 import tarfile
-import tempfile
+import time
 import warnings
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 from scipy.spatial.distance import cdist
 
-from skimage.measure import regionprops
+from skimage.measure import regionprops_table
 from skimage.segmentation import relabel_sequential
 
 from deepcell_toolbox.utils import resize
 
 
-def clean_up_annotations(y, uid=None, data_format='channels_last'):
+_DIGITS_PATTERN = re.compile('([0-9]+)')
+
+
+def _drop_background(labels):
+    """Remove the background label from the sorted output of ``np.unique``.
+
+    Args:
+        labels (np.array): sorted unique labels of a label image.
+
+    Returns:
+        np.array: The labels without the background label 0.
+    """
+    return labels[1:] if labels.size and labels[0] == 0 else labels
+
+
+def _get_label_presence(y, present):
+    """Flag which labels appear in the label image ``y``.
+
+    This is a single linear pass over ``y``, avoiding the sort in np.unique.
+
+    Args:
+        y (np.array): non-negative integer label image.
+        present (np.array): boolean buffer of length ``y.max() + 1`` or more,
+            overwritten with whether each label is present in ``y``.
+
+    Returns:
+        np.array: The filled ``present`` buffer.
+    """
+    present[:] = False
+    present[y.ravel()] = True
+    return present
+
+
+class LabelIndex(object):
+    """Label lookups for the frames of a single movie, computed once.
+
+    The maximum label and presence buffer are shared by every lookup, so
+    utilities called in sequence on the same movie avoid rescanning it.
+    Sparse labels, with a maximum label larger than the pixels per frame,
+    are looked up with np.unique instead of the presence buffer.
+    The index is only valid while the label data is not modified.
+
+    Args:
+        y (np.array): non-negative integer labels of a movie. Labels stored
+            in a non-integer dtype must have integer values.
+        data_format (str): determines the order of the channel axis,
+            one of 'channels_first' and 'channels_last'.
+
+    Raises:
+        ValueError: y contains negative or non-integer labels.
+    """
+
+    def __init__(self, y, data_format='channels_last'):
+        labels = np.asarray(y)
+        if not np.issubdtype(labels.dtype, np.integer):
+            if not np.all(np.mod(labels, 1) == 0):
+                raise ValueError('Labels must have integer values.')
+            labels = labels.astype('int64')
+
+        if labels.size and labels.min() < 0:
+            raise ValueError('Labels must not be negative.')
+
+        self.y = y
+        self.time_axis = 1 if data_format == 'channels_first' else 0
+        self.num_frames = labels.shape[self.time_axis]
+        self.max_label = int(labels.max()) if labels.size else 0
+        self._labels = labels
+        self._present = None
+        self._frames_by_cell = None
+
+        # the presence buffer is only cheaper than sorting while it is
+        # no larger than a frame, as in count_pairs.
+        num_pixels = labels.size // max(self.num_frames, 1)
+        self._dense = self.max_label + 1 <= max(num_pixels, 1)
+
+    def _get_frame(self, frame):
+        if self.time_axis == 1:
+            return self._labels[:, frame]
+        return self._labels[frame]
+
+    def presence(self, frame):
+        """Flag which labels appear in the frame.
+
+        The returned buffer is reused by the next lookup. It is allocated
+        on first use and scales with ``max_label``, not the frame size.
+
+        Args:
+            frame (int): Frame of interest.
+
+        Returns:
+            np.array: Boolean array of length ``max_label + 1``.
+        """
+        if self._present is None:
+            self._present = np.empty(self.max_label + 1, dtype=bool)
+        return _get_label_presence(self._get_frame(frame), self._present)
+
+    def unique_nonzero(self, frame):
+        """Find the sorted cell labels in the frame, without the background.
+
+        Args:
+            frame (int): Frame of interest.
+
+        Returns:
+            np.array: All cell labels in the frame.
+        """
+        if not self._dense:
+            return _drop_background(np.unique(self._get_frame(frame)))
+        return np.flatnonzero(self.presence(frame)[1:]) + 1
+
+    def frames_by_cell(self):
+        """Find the frames in which each cell appears.
+
+        Returns:
+            dict: Map of each cell label to a sorted list of frames.
+        """
+        if self._frames_by_cell is None:
+            frames_by_cell = defaultdict(list)
+            for frame in range(self.num_frames):
+                for cell in self.unique_nonzero(frame):
+                    frames_by_cell[int(cell)].append(frame)
+            self._frames_by_cell = dict(frames_by_cell)
+        return self._frames_by_cell
+
+
+def _validate_label_index(label_index, y, data_format='channels_last'):
+    """Check that a prebuilt LabelIndex was built from ``y``.
+
+    Args:
+        label_index (LabelIndex): prebuilt index of ``y``.
+        y (np.array): label data passed along with the index.
+        data_format (str): determines the order of the channel axis,
+            one of 'channels_first' and 'channels_last'.
+
+    Raises:
+        ValueError: label_index was built from a different array or with a
+            different data_format.
+    """
+    if label_index.y is not y:
+        raise ValueError('label_index was not built from the given `y`.')
+
+    time_axis = 1 if data_format == 'channels_first' else 0
+    if label_index.time_axis != time_axis:
+        raise ValueError('label_index was built with a different data_format.')
+
+
+def clean_up_annotations(y, uid=None, data_format='channels_last',
+                         label_index=None):
     """Relabels every frame in the label matrix.
 
     Args:
@@ -55,28 +204,48 @@ def clean_up_annotations(y, uid=None, data_format='channels_last'):
         uid (int, optional): starting ID to begin labeling cells.
         data_format (str): determines the order of the channel axis,
             one of 'channels_first' and 'channels_last'.
+        label_index (LabelIndex, optional): prebuilt index of ``y``.
 
     Returns:
         np.array: Cleaned up annotations.
+
+    Raises:
+        ValueError: label_index was not built from y with the same data_format.
     """
+    if label_index is not None:
+        _validate_label_index(label_index, y, data_format=data_format)
+
     y = y.astype('int32')
+    if label_index is None:
+        label_index = LabelIndex(y, data_format=data_format)
+
     time_axis = 1 if data_format == 'channels_first' else 0
     num_frames = y.shape[time_axis]
 
-    all_uniques = []
-    for f in range(num_frames):
-        cells = np.unique(y[:, f] if data_format == 'channels_first' else y[f])
-        cells = np.delete(cells, np.where(cells == 0))
-        all_uniques.append(cells)
+    all_uniques = [label_index.unique_nonzero(f) for f in range(num_frames)]
 
     # The annotations need to be unique across all frames
     uid = sum(len(x) for x in all_uniques) + 1 if uid is None else uid
     for frame, unique_cells in zip(range(num_frames), all_uniques):
+        if unique_cells.size == 0:
+            continue  # nothing to relabel, frame is all background
+
         y_frame = y[:, frame] if data_format == 'channels_first' else y[frame]
-        y_frame_new = np.zeros(y_frame.shape)
-        for cell_label in unique_cells:
-            y_frame_new[y_frame == cell_label] = uid
-            uid += 1
+
+        if unique_cells[-1] < y_frame.size:
+            # map every label in the frame to its new ID with a single lookup
+            lut = np.zeros(unique_cells[-1] + 1, dtype='int32')
+            lut[unique_cells] = np.arange(uid, uid + unique_cells.size)
+            y_frame_new = lut[y_frame]
+        else:
+            # sparse large labels would need a lookup far larger than the
+            # frame, so find each label's rank among the frame's labels.
+            y_frame_new = np.zeros_like(y_frame)
+            cells = y_frame != 0
+            ranks = np.searchsorted(unique_cells, y_frame[cells])
+            y_frame_new[cells] = ranks + uid
+        uid += unique_cells.size
+
         if data_format == 'channels_first':
             y[:, frame] = y_frame_new
         else:
@@ -98,15 +267,29 @@ def count_pairs(y, same_probability=0.5, data_format='channels_last'):
     """
     total_pairs = 0
     zaxis = 2 if data_format == 'channels_first' else 1
+    num_frames = y.shape[zaxis]
+    num_pixels = y.size // max(y.shape[0] * num_frames, 1)
+
+    # bincount needs non-negative integers, and sparse large labels would
+    # need far more bins than pixels, so fall back to np.unique for those.
+    num_bins = int(y.max()) + 1 if y.size else 1
+    use_bincount = (np.issubdtype(y.dtype, np.integer) and
+                    (not y.size or y.min() >= 0) and
+                    num_bins <= max(num_pixels, 1))
+
+    # offset each frame's labels so a single bincount counts every frame
+    offsets = np.arange(num_frames, dtype='int64')[:, np.newaxis] * num_bins
     for b in range(y.shape[0]):
         # count the number of cells in each image of the batch
-        cells_per_image = []
-        for f in range(y.shape[zaxis]):
-            if data_format == 'channels_first':
-                num_cells = len(np.unique(y[b, :, f, :, :]))
-            else:
-                num_cells = len(np.unique(y[b, f, :, :, :]))
-            cells_per_image.append(num_cells)
+        frames = np.moveaxis(y[b], zaxis - 1, 0).reshape(num_frames, -1)
+        if use_bincount:
+            frames = frames.astype('int64', copy=False)
+            hits = np.bincount((frames + offsets).ravel(),
+                               minlength=num_frames * num_bins)
+            hits = hits.reshape(num_frames, num_bins)
+            cells_per_image = np.count_nonzero(hits, axis=1).tolist()
+        else:
+            cells_per_image = [len(np.unique(f)) for f in frames]
 
         # Since there are many more possible non-self pairings than there
         # are self pairings, we want to estimate the number of possible
@@ -129,16 +312,30 @@ def count_pairs(y, same_probability=0.5, data_format='channels_last'):
     return total_pairs
 
 
-def load_trks(filename):
+def load_trks(filename, mmap_mode=None):
     """Load a trk/trks file.
 
     Args:
         filename (str or BytesIO): full path to the file including .trk/.trks
             or BytesIO object with trk file data
+        mmap_mode (str): If not ``None``, memory-map the raw and tracked
+            arrays of an uncompressed trk file on disk, either read-only
+            ('r') or copy-on-write ('c'). The memmaps reference the trk file
+            itself, so it must not be modified or removed while they are in
+            use. Compressed files and BytesIO objects are always loaded
+            into memory.
 
     Returns:
         dict: A dictionary with raw, tracked, and lineage data.
+
+    Raises:
+        ValueError: mmap_mode is not None, 'r' or 'c'.
     """
+    # writable modes would modify, or even truncate, the trk file itself
+    if mmap_mode not in {None, 'r', 'c'}:
+        raise ValueError('mmap_mode must be one of None, "r" or "c". '
+                         'Found %s' % mmap_mode)
+
     if isinstance(filename, io.BytesIO):
         kwargs = {'fileobj': filename}
     else:
@@ -146,16 +343,18 @@ def load_trks(filename):
 
     with tarfile.open(mode='r', **kwargs) as trks:
 
-        # numpy can't read these from disk...
-        with io.BytesIO() as array_file:
-            array_file.write(trks.extractfile('raw.npy').read())
-            array_file.seek(0)
-            raw = np.load(array_file)
+        # members of an uncompressed tarfile are stored as-is in the file
+        if mmap_mode is not None and isinstance(trks.fileobj, io.BufferedReader):
+            mmap_filename = trks.name
+        else:
+            mmap_filename = None
 
-        with io.BytesIO() as array_file:
-            array_file.write(trks.extractfile('tracked.npy').read())
-            array_file.seek(0)
-            tracked = np.load(array_file)
+        raw = _load_npy_from_tar(trks, 'raw.npy',
+                                 mmap_filename=mmap_filename,
+                                 mmap_mode=mmap_mode)
+        tracked = _load_npy_from_tar(trks, 'tracked.npy',
+                                     mmap_filename=mmap_filename,
+                                     mmap_mode=mmap_mode)
 
         # trks.extractfile opens a file in bytes mode, json can't use bytes.
         try:
@@ -176,24 +375,92 @@ def load_trks(filename):
     return {'lineages': lineages, 'X': raw, 'y': tracked}
 
 
-def trk_folder_to_trks(dirname, trks_filename):
+def _load_npy_from_tar(tar, arcname, mmap_filename=None, mmap_mode=None):
+    """Load a npy file from an open tarfile without an intermediate copy.
+
+    ``np.load`` can't read the tarfile members directly, as it mistakes them
+    for files on disk. Instead, parse the npy header and read the array data
+    straight into the output array.
+
+    Args:
+        tar (tarfile.TarFile): tarfile opened for reading.
+        arcname (str): name of the npy member in the tarfile.
+        mmap_filename (str): path of the uncompressed tarfile on disk.
+            If provided, the array data is memory-mapped from this file.
+        mmap_mode (str): mode used to memory-map the array data.
+
+    Returns:
+        np.array: The loaded array.
+
+    Raises:
+        ValueError: the npy data is truncated.
+    """
+    member = tar.getmember(arcname)
+    with tar.extractfile(member) as npy_file:
+        version = np.lib.format.read_magic(npy_file)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(npy_file)
+        elif version == (2, 0):
+            header = np.lib.format.read_array_header_2_0(npy_file)
+        else:
+            header = None
+
+        if header is None or header[2].hasobject:
+            # fall back to reading the whole member into memory
+            npy_file.seek(0)
+            with io.BytesIO(npy_file.read()) as array_file:
+                return np.load(array_file)
+
+        shape, fortran_order, dtype = header
+
+        can_mmap = mmap_filename is not None and not member.issparse()
+        if can_mmap and dtype.itemsize * int(np.prod(shape)) > 0:
+            offset = member.offset_data + npy_file.tell()
+            return np.memmap(mmap_filename, dtype=dtype, mode=mmap_mode,
+                             offset=offset, shape=shape,
+                             order='F' if fortran_order else 'C')
+
+        # fortran ordered data is stored as the transpose of a C array
+        array = np.empty(shape[::-1] if fortran_order else shape, dtype=dtype)
+        nbytes = npy_file.readinto(array.reshape(-1).view(np.uint8))
+        if nbytes != array.nbytes:
+            raise ValueError('Invalid .trk file, {} is truncated.'.format(
+                arcname))
+
+    return array.T if fortran_order else array
+
+
+def _alphanum_key(text):
+    """Sort key to order strings with embedded numbers naturally."""
+    return tuple(int(c) if c.isdigit() else c
+                 for c in _DIGITS_PATTERN.split(text))
+
+
+def trk_folder_to_trks(dirname, trks_filename, num_workers=None):
     """Compiles a directory of trk files into one trks_file.
 
     Args:
         dirname (str): full path to the directory containing multiple trk files.
         trks_filename (str): desired filename (the name should end in .trks).
+        num_workers (int): number of threads used to load the trk files.
+            Defaults to ``None``, loading the files one at a time.
     """
     lineages = []
     raw = []
     tracked = []
 
-    convert = lambda text: int(text) if text.isdigit() else text
-    alphanum_key = lambda key: [convert(c) for c in re.split('([0-9]+)', key)]
     file_list = os.listdir(dirname)
-    file_list_sorted = sorted(file_list, key=alphanum_key)
+    file_list_sorted = sorted(file_list, key=_alphanum_key)
+    paths = [os.path.join(dirname, f) for f in file_list_sorted]
 
-    for filename in file_list_sorted:
-        trk = load_trks(os.path.join(dirname, filename))
+    if num_workers is None:
+        trks = [load_trks(path) for path in paths]
+    else:
+        # decompression releases the GIL, so compressed files load in parallel
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            trks = list(executor.map(load_trks, paths))
+
+    for trk in trks:
         lineages.append(trk['lineages'][0])  # this is loading a single track
         raw.append(trk['X'])
         tracked.append(trk['y'])
@@ -203,7 +470,7 @@ def trk_folder_to_trks(dirname, trks_filename):
     save_trks(file_path, lineages, raw, tracked)
 
 
-def save_trks(filename, lineages, raw, tracked):
+def save_trks(filename, lineages, raw, tracked, compression=None):
     """Saves raw, tracked, and lineage data from multiple movies into one trks_file.
 
     Args:
@@ -212,6 +479,8 @@ def save_trks(filename, lineages, raw, tracked):
         lineages (list): a list of dictionaries saved as a json.
         raw (np.array): raw images data.
         tracked (np.array): annotated image data.
+        compression (str): Compression of the tarfile, one of
+            ``None``, 'gz', 'bz2' or 'xz'. Defaults to no compression.
 
     Raises:
         ValueError: filename does not end in ".trks".
@@ -224,10 +493,11 @@ def save_trks(filename, lineages, raw, tracked):
                     lineages=lineages,
                     raw=raw,
                     tracked=tracked,
-                    lineage_name='lineages.json')
+                    lineage_name='lineages.json',
+                    compression=compression)
 
 
-def save_trk(filename, lineage, raw, tracked):
+def save_trk(filename, lineage, raw, tracked, compression=None):
     """Saves raw, tracked, and lineage data for one movie into a trk_file.
 
     Args:
@@ -237,6 +507,8 @@ def save_trk(filename, lineage, raw, tracked):
             lineage dictionary
         raw (np.array): raw images data.
         tracked (np.array): annotated image data.
+        compression (str): Compression of the tarfile, one of
+            ``None``, 'gz', 'bz2' or 'xz'. Defaults to no compression.
 
     Raises:
         ValueError: filename does not end in ".trks".
@@ -257,10 +529,12 @@ def save_trk(filename, lineage, raw, tracked):
                     lineages=lineage,
                     raw=raw,
                     tracked=tracked,
-                    lineage_name='lineage.json')
+                    lineage_name='lineage.json',
+                    compression=compression)
 
 
-def save_track_data(filename, lineages, raw, tracked, lineage_name):
+def save_track_data(filename, lineages, raw, tracked, lineage_name,
+                    compression=None):
     """Base function for saving tracking data as either trk or trks
 
     Args:
@@ -271,36 +545,53 @@ def save_track_data(filename, lineages, raw, tracked, lineage_name):
         tracked (np.array): annotated image data.
         lineage_name (str): Filename for the lineage file in the tarfile, either 'lineages.json'
             or 'lineage.json'
+        compression (str): Compression of the tarfile, one of
+            ``None``, 'gz', 'bz2' or 'xz'. Raw image data rarely compresses
+            well, so no compression is used by default.
+
+    Raises:
+        ValueError: compression is not a supported type.
     """
+    if compression not in {None, 'gz', 'bz2', 'xz'}:
+        raise ValueError('compression must be one of None, "gz", "bz2" or '
+                         '"xz". Found %s' % compression)
+
+    mode = 'w' if compression is None else 'w:{}'.format(compression)
 
     if isinstance(filename, io.BytesIO):
         kwargs = {'fileobj': filename}
     else:
         kwargs = {'name': filename}
 
-    with tarfile.open(mode='w:gz', **kwargs) as trks:
-        # disable auto deletion and close/delete manually
-        # to resolve double-opening issue on Windows.
-        with tempfile.NamedTemporaryFile('w', delete=False) as lineages_file:
-            json.dump(lineages, lineages_file, indent=4)
-            lineages_file.flush()
-            lineages_file.close()
-            trks.add(lineages_file.name, lineage_name)
-            os.remove(lineages_file.name)
-
-        with tempfile.NamedTemporaryFile(delete=False) as raw_file:
+    with tarfile.open(mode=mode, **kwargs) as trks:
+        # write each member from memory rather than through a tempfile
+        with io.BytesIO() as lineages_file:
+            # without indent, json.dumps uses the C accelerated encoder
+            lineages_file.write(json.dumps(lineages).encode())
+            _add_buffer_to_tar(trks, lineages_file, lineage_name)
+
+        with io.BytesIO() as raw_file:
             np.save(raw_file, raw)
-            raw_file.flush()
-            raw_file.close()
-            trks.add(raw_file.name, 'raw.npy')
-            os.remove(raw_file.name)
+            _add_buffer_to_tar(trks, raw_file, 'raw.npy')
 
-        with tempfile.NamedTemporaryFile(delete=False) as tracked_file:
+        with io.BytesIO() as tracked_file:
             np.save(tracked_file, tracked)
-            tracked_file.flush()
-            tracked_file.close()
-            trks.add(tracked_file.name, 'tracked.npy')
-            os.remove(tracked_file.name)
+            _add_buffer_to_tar(trks, tracked_file, 'tracked.npy')
+
+
+def _add_buffer_to_tar(tar, buffer, arcname):
+    """Add the contents of an in-memory buffer to an open tarfile.
+
+    Args:
+        tar (tarfile.TarFile): tarfile opened for writing.
+        buffer (io.BytesIO): buffer with the member data.
+        arcname (str): name of the member in the tarfile.
+    """
+    info = tarfile.TarInfo(name=arcname)
+    info.size = buffer.seek(0, io.SEEK_END)
+    info.mtime = time.time()
+    buffer.seek(0)
+    tar.addfile(info, buffer)
 
 
 def trks_stats(filename):
@@ -349,8 +640,7 @@ def trks_stats(filename):
         num_cells_in_frame = []
         for frame in range(len(y[batch])):
             y_frame = y[batch, frame]
-            cells_in_frame = np.unique(y_frame)
-            cells_in_frame = np.delete(cells_in_frame, 0)  # rm background
+            cells_in_frame = _drop_background(np.unique(y_frame))
             num_cells_in_frame.append(len(cells_in_frame))
         avg_cells_in_frame.append(np.average(num_cells_in_frame))
 
@@ -363,22 +653,29 @@ def trks_stats(filename):
     print('Average number of frames per track         - ', int(avg_num_frames_per_track))
 
 
-def get_max_cells(y):
+def get_max_cells(y, label_index=None):
     """Helper function for finding the maximum number of cells in a frame of a movie, across
     all frames of the movie. Can be used for batches/tracks interchangeably with frames/cells.
 
     Args:
         y (np.array): Annotated image data
+        label_index (LabelIndex, optional): prebuilt index of ``y``.
 
     Returns:
         int: The maximum number of cells in any frame
+
+    Raises:
+        ValueError: label_index was not built from y.
     """
+    if label_index is None:
+        label_index = LabelIndex(y)
+    _validate_label_index(label_index, y)
+
     max_cells = 0
     for frame in range(y.shape[0]):
-        cells = np.unique(y[frame])
-        n_cells = cells[cells != 0].shape[0]
+        n_cells = label_index.unique_nonzero(frame).size
         if n_cells > max_cells:
-            max_cells = n_cells
+            max_cells = int(n_cells)
     return max_cells
 
 
@@ -399,81 +696,84 @@ def normalize_adj_matrix(adj, epsilon=1e-5):
     if input_rank not in {3, 4}:
         raise ValueError('Only 3 & 4 dim adjacency matrices are supported')
 
-    if input_rank == 3:
-        # temporarily include a batch dimension for consistent processing
-        adj = np.expand_dims(adj, axis=0)
+    # create degree matrix, D * A * D with diagonal D is an elementwise scaling
+    degrees = (np.sum(adj, axis=-2) + epsilon) ** -0.5
+    normalized_adj = (degrees[..., :, np.newaxis] * adj *
+                      degrees[..., np.newaxis, :])
 
-    normalized_adj = np.zeros(adj.shape, dtype='float32')
+    return normalized_adj.astype('float32', copy=False)
 
-    for t in range(adj.shape[1]):
-        adj_frame = adj[:, t]
-        # create degree matrix
-        degrees = np.sum(adj_frame, axis=1)
-        for batch, degree in enumerate(degrees):
-            degree = (degree + epsilon) ** -0.5
-            degree_matrix = np.diagflat(degree)
 
-            normalized = np.matmul(degree_matrix, adj_frame[batch])
-            normalized = np.matmul(normalized, degree_matrix)
-            normalized_adj[batch, t] = normalized
-
-    if input_rank == 3:
-        # remove batch axis
-        normalized_adj = normalized_adj[0]
-
-    return normalized_adj
-
-
-def relabel_sequential_lineage(y, lineage):
+def relabel_sequential_lineage(y, lineage, label_index=None):
     """Ensure the lineage information is sequentially labeled.
 
     Args:
         y (np.array): Annotated z-stack of image labels.
         lineage (dict): Lineage data for y.
+        label_index (LabelIndex, optional): prebuilt index of ``y``.
 
     Returns:
         tuple(np.array, dict): The relabeled array and corrected lineage.
+
+    Raises:
+        ValueError: label_index was not built from y.
     """
+    if label_index is None:
+        label_index = LabelIndex(y)
+    _validate_label_index(label_index, y)
+
     y_relabel, fw, _ = relabel_sequential(y)
 
-    new_lineage = {}
+    frames_by_cell = label_index.frames_by_cell()
+    cell_ids = np.array(sorted(frames_by_cell), dtype='int64')
+
+    # lookup table of new labels, missing labels get mapped to 0
+    lut = np.zeros(label_index.max_label + 1, dtype='int64')
+    lut[cell_ids] = fw[cell_ids]
 
-    cell_ids = np.unique(y)
-    cell_ids = cell_ids[cell_ids != 0]
-    for cell_id in cell_ids:
-        new_cell_id = fw[cell_id]
+    def relabel(labels):
+        labels = np.asarray(labels, dtype='int64')
+        valid = (labels >= 0) & (labels < lut.shape[0])
+        return np.where(valid, lut[np.where(valid, labels, 0)], 0)
 
-        new_lineage[new_cell_id] = {}
+    # Fix label
+    # TODO: label == track ID?
+    new_cell_ids = relabel(cell_ids).tolist()
 
-        # Fix label
-        # TODO: label == track ID?
-        new_lineage[new_cell_id]['label'] = new_cell_id
+    # Fix parent
+    parents = [lineage[cell_id]['parent'] for cell_id in cell_ids]
+    new_parents = relabel([0 if p is None else p for p in parents]).tolist()
 
-        # Fix parent
-        parent = lineage[cell_id]['parent']
-        new_parent = fw[parent] if parent is not None else parent
-        new_lineage[new_cell_id]['parent'] = new_parent
+    # Fix daughters, relabeled together and split back up per cell
+    daughters = [lineage[cell_id]['daughters'] for cell_id in cell_ids]
+    num_daughters = [len(d) for d in daughters]
+    all_daughters = [d for cell_daughters in daughters for d in cell_daughters]
+    new_daughters = np.split(relabel(all_daughters), np.cumsum(num_daughters)[:-1])
+
+    new_lineage = {}
+    for i, cell_id in enumerate(cell_ids):
+        new_cell_id = new_cell_ids[i]
 
-        # Fix daughters
-        daughters = lineage[cell_id]['daughters']
-        new_lineage[new_cell_id]['daughters'] = []
-        for d in daughters:
-            new_daughter = fw[d]
+        cell_daughters = []
+        for d, new_daughter in zip(daughters[i], new_daughters[i].tolist()):
             if not new_daughter:  # missing labels get mapped to 0
                 warnings.warn('Cell {} has daughter {} which is not found '
                               'in the label image `y`.'.format(cell_id, d))
             else:
-                new_lineage[new_cell_id]['daughters'].append(new_daughter)
+                cell_daughters.append(new_daughter)
 
-        # Fix frames
-        y_true = np.any(y == cell_id, axis=(1, 2))
-        y_index = y_true.nonzero()[0]
-        new_lineage[new_cell_id]['frames'] = list(y_index)
+        new_lineage[new_cell_id] = {
+            'label': new_cell_id,
+            'parent': None if parents[i] is None else new_parents[i],
+            'daughters': cell_daughters,
+            # Fix frames
+            'frames': list(frames_by_cell[cell_id]),
+        }
 
     return y_relabel, new_lineage
 
 
-def is_valid_lineage(y, lineage):
+def is_valid_lineage(y, lineage, label_index=None):
     """Check if a cell lineage of a single movie is valid.
 
     Daughter cells must exist in the frame after the parent's final frame.
@@ -481,12 +781,22 @@ def is_valid_lineage(y, lineage):
     Args:
         y (numpy.array): The 3D label mask.
         lineage (dict): The cell lineages for a single movie.
+        label_index (LabelIndex, optional): prebuilt index of ``y``.
 
     Returns:
         bool: Whether or not the lineage is valid.
+
+    Raises:
+        ValueError: label_index was not built from y.
     """
-    all_cells = np.unique(y)
-    all_cells = set([c for c in all_cells if c])
+    if label_index is None:
+        label_index = LabelIndex(y)
+    _validate_label_index(label_index, y)
+
+    # the frames of each cell are also used to find all cells in the movie,
+    # so each cell's frames are validated with a plain list comparison.
+    frames_by_cell = label_index.frames_by_cell()
+    all_cells = set(frames_by_cell)
 
     # every lineage should have valid fields
     for cell_label, cell_lineage in lineage.items():
@@ -500,9 +810,7 @@ def is_valid_lineage(y, lineage):
         all_cells.remove(cell_label)
 
         # validate `frames`
-        y_true = np.any(y == cell_label, axis=(1, 2))
-        y_index = y_true.nonzero()[0]
-        frames = list(y_index)
+        frames = frames_by_cell[cell_label]
         if frames != cell_lineage['frames']:
             warnings.warn('Cell {} has invalid frames'.format(cell_label))
             return False
@@ -560,13 +868,41 @@ def is_valid_lineage(y, lineage):
     return True  # all cell lineages are valid!
 
 
-def get_image_features(X, y, appearance_dim=32):
+def get_adjacency_matrix(centroids, distance_threshold=64):
+    """Find which objects are within a distance of each other.
+
+    Args:
+        centroids (np.array): centroids of shape (n, 2).
+        distance_threshold (int): maximum distance between adjacent objects.
+
+    Returns:
+        np.array: Adjacency matrix of shape (n, n).
+    """
+    if centroids.shape[0] < 2000:
+        distance = cdist(centroids, centroids, metric='euclidean')
+    else:
+        # |a - b|^2 = |a|^2 + |b|^2 - 2ab uses a single BLAS matmul,
+        # which is much faster than cdist for many objects.
+        centroids = centroids.astype('float64')
+        sq_norms = np.sum(centroids ** 2, axis=-1)
+        sq_distance = (sq_norms[:, np.newaxis] + sq_norms[np.newaxis, :] -
+                       2 * np.dot(centroids, centroids.T))
+        distance = np.sqrt(np.maximum(sq_distance, 0))
+
+    adj_matrix = distance < distance_threshold
+    return adj_matrix.astype('float32')
+
+
+def get_image_features(X, y, appearance_dim=32, distance_threshold=None):
     """Return features for every object in the array.
 
     Args:
         X (np.array): a 3D numpy array of raw data of shape (x, y, c).
         y (np.array): a 3D numpy array of integer labels of shape (x, y, 1).
         appearance_dim (int): The resized shape of the appearance feature.
+        distance_threshold (int): maximum distance between adjacent objects.
+            If provided, the adjacency matrix of shape (n, n) is included
+            as 'adj_matrix'. Defaults to ``None``, skipping it.
 
     Returns:
         dict: A dictionary of feature names to np.arrays of shape
@@ -574,48 +910,59 @@ def get_image_features(X, y, appearance_dim=32):
     """
     appearance_dim = int(appearance_dim)
 
+    y_frame = y[..., 0]
+
     # each feature will be ordered based on the label.
     # labels are also stored and can be fetched by index.
-    num_labels = len(np.unique(y)) - 1
-    labels = np.zeros((num_labels,), dtype='int32')
-    centroids = np.zeros((num_labels, 2), dtype='float32')
-    morphologies = np.zeros((num_labels, 3), dtype='float32')
+    # perimeter and eccentricity are computed for every object in one call.
+    props = regionprops_table(
+        y_frame, properties=('label', 'bbox', 'perimeter', 'eccentricity'))
+
+    labels = props['label'].astype('int32')
+    num_labels = labels.shape[0]
+
+    # Get area and centroid of every object with weighted bincounts.
+    # bincount cannot safely cast uint64 labels, so cast them once here.
+    y_flat = y_frame.ravel().astype(np.intp, copy=False)
+    rows, cols = np.indices(y_frame.shape)
+    areas = np.bincount(y_flat)[labels]
+    row_sums = np.bincount(y_flat, weights=rows.ravel())[labels]
+    col_sums = np.bincount(y_flat, weights=cols.ravel())[labels]
+
+    centroids = np.stack([row_sums, col_sums], axis=-1) / areas[:, np.newaxis]
+    centroids = centroids.astype('float32')
+
+    morphologies = np.stack([
+        areas,
+        props['perimeter'],
+        props['eccentricity'],
+    ], axis=-1).astype('float32')
+
+    # Get appearance, crops vary in size so each is resized separately
     appearances = np.zeros((num_labels, appearance_dim,
                             appearance_dim, X.shape[-1]), dtype='float32')
+    resize_shape = (appearance_dim, appearance_dim)
 
-    # iterate over all objects in y
-    props = regionprops(y[..., 0], cache=False)
-    for i, prop in enumerate(props):
-        # Get label
-        labels[i] = prop.label
-
-        # Get centroid
-        centroid = np.array(prop.centroid)
-        centroids[i] = centroid
-
-        # Get morphology
-        morphology = np.array([
-            prop.area,
-            prop.perimeter,
-            prop.eccentricity
-        ])
-        morphologies[i] = morphology
-
-        # Get appearance
-        minr, minc, maxr, maxc = prop.bbox
+    def get_appearance(i):
+        minr, minc = props['bbox-0'][i], props['bbox-1'][i]
+        maxr, maxc = props['bbox-2'][i], props['bbox-3'][i]
         appearance = np.copy(X[minr:maxr, minc:maxc, :])
-        resize_shape = (appearance_dim, appearance_dim)
-        appearance = resize(appearance, resize_shape)
-        appearances[i] = appearance
+        appearances[i] = resize(appearance, resize_shape)
 
-    # Get adjacency matrix
-    # distance = cdist(centroids, centroids, metric='euclidean') < distance_threshold
-    # adj_matrix = distance.astype('float32')
+    # the underlying resize releases the GIL, so crops are resized in threads
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(get_appearance, range(num_labels)))
 
-    return {
+    features = {
         'appearances': appearances,
         'centroids': centroids,
         'labels': labels,
         'morphologies': morphologies,
-        # 'adj_matrix': adj_matrix,
     }
+
+    # Get adjacency matrix
+    if distance_threshold is not None:
+        features['adj_matrix'] = get_adjacency_matrix(
+            centroids, distance_threshold)
+
+    return features
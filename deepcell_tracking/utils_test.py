@@ -77,6 +77,84 @@ def get_dummy_data(num_labels=3, batches=2):
 
 class TestTrackingUtils(object):
 
+    def test_label_index(self):
+        movie = get_annotated_movie(img_size=256,
+                                    labels_per_frame=3,
+                                    frames=3,
+                                    mov_type='random', seed=1,
+                                    data_format='channels_last')
+
+        for data_format in ('channels_last', 'channels_first'):
+            y = movie if data_format == 'channels_last' else np.moveaxis(movie, -1, 0)
+            label_index = utils.LabelIndex(y, data_format=data_format)
+            assert label_index.num_frames == movie.shape[0]
+            assert label_index.max_label == movie.max()
+
+            expected_frames = {}
+            for frame in range(movie.shape[0]):
+                expected = np.unique(movie[frame])
+                expected = expected[expected != 0]
+                np.testing.assert_array_equal(
+                    label_index.unique_nonzero(frame), expected)
+
+                presence = label_index.presence(frame)
+                assert presence.shape == (movie.max() + 1,)
+                np.testing.assert_array_equal(
+                    np.flatnonzero(presence), np.unique(movie[frame]))
+
+                for cell in expected:
+                    expected_frames.setdefault(int(cell), []).append(frame)
+
+            assert label_index.frames_by_cell() == expected_frames
+
+            # sparse large labels are found without the presence buffer
+            sparse_y = y * 1000000
+            sparse_index = utils.LabelIndex(sparse_y, data_format=data_format)
+            assert sparse_index.max_label == movie.max() * 1000000
+            for frame in range(movie.shape[0]):
+                np.testing.assert_array_equal(
+                    sparse_index.unique_nonzero(frame),
+                    label_index.unique_nonzero(frame) * 1000000)
+            assert sparse_index._present is None
+
+        assert utils.get_max_cells(movie * 1000000) == utils.get_max_cells(movie)
+
+        # integer valued labels of any dtype are supported
+        label_index = utils.LabelIndex(movie.astype('float32'))
+        assert label_index.max_label == movie.max()
+        np.testing.assert_array_equal(label_index.unique_nonzero(0),
+                                      utils.LabelIndex(movie).unique_nonzero(0))
+        assert utils.get_max_cells(np.zeros((2, 4, 4, 1))) == 0
+
+        # negative or fractional labels are invalid
+        with pytest.raises(ValueError):
+            utils.LabelIndex(movie - 1)
+        with pytest.raises(ValueError):
+            utils.LabelIndex(movie + 0.5)
+
+        # the index can be shared by utilities working on the same movie
+        label_index = utils.LabelIndex(movie)
+        assert utils.get_max_cells(movie, label_index=label_index) == 3
+        cleaned = utils.clean_up_annotations(movie, label_index=label_index)
+        np.testing.assert_array_equal(cleaned, utils.clean_up_annotations(movie))
+
+        # the index must be built from the same array and data_format
+        with pytest.raises(ValueError):
+            utils.get_max_cells(movie.copy(), label_index=label_index)
+        with pytest.raises(ValueError):
+            utils.is_valid_lineage(movie.copy(), {}, label_index=label_index)
+        with pytest.raises(ValueError):
+            utils.relabel_sequential_lineage(movie.copy(), {},
+                                             label_index=label_index)
+        with pytest.raises(ValueError):
+            utils.clean_up_annotations(movie.copy(), label_index=label_index)
+
+        label_index = utils.LabelIndex(movie, data_format='channels_first')
+        with pytest.raises(ValueError):
+            utils.get_max_cells(movie, label_index=label_index)
+        with pytest.raises(ValueError):
+            utils.clean_up_annotations(movie, label_index=label_index)
+
     def test_clean_up_annotations(self):
         img = sk.measure.label(sk.data.binary_blobs(length=256, n_dim=2)) * 3
         img = np.expand_dims(img, axis=-1)
@@ -122,6 +200,10 @@ class TestTrackingUtils(object):
                     expected = np.append(0, expected)
                 np.testing.assert_array_equal(unique, expected)
 
+            # sparse large labels are relabeled the same way
+            sparse_cleaned = utils.clean_up_annotations(movie * 1000000, uid=uid)
+            np.testing.assert_array_equal(sparse_cleaned, cleaned)
+
     def test_count_pairs(self):
         batches = 1
         frames = 2
@@ -142,6 +224,18 @@ class TestTrackingUtils(object):
             y, same_probability=prob, data_format='channels_first')
         assert pairs == expected
 
+        # float and unsigned labels
+        y = np.random.randint(low=0, high=classes + 1,
+                              size=(batches, frames, 30, 30, 1))
+        for dtype in ('float64', 'uint64'):
+            pairs = utils.count_pairs(y.astype(dtype), same_probability=prob)
+            assert pairs == expected
+
+        # sparse large labels
+        y = y * 1000000
+        pairs = utils.count_pairs(y, same_probability=prob)
+        assert pairs == expected
+
     def test_save_trks(self, tmpdir):
         X = get_image(30, 30)
         y = np.random.randint(low=0, high=10, size=X.shape)
@@ -207,6 +301,102 @@ class TestTrackingUtils(object):
         np.testing.assert_array_equal(X, loaded['X'])
         np.testing.assert_array_equal(y, loaded['y'])
 
+    def test_save_track_data(self, tmpdir):
+        X = get_image(30, 30)
+        y = np.random.randint(low=0, high=10, size=X.shape)
+        lineage = [dict()]
+
+        for compression in (None, 'gz', 'bz2', 'xz'):
+            filename = os.path.join(str(tmpdir), '{}.trks'.format(compression))
+            utils.save_track_data(filename=filename,
+                                  lineages=lineage,
+                                  raw=X,
+                                  tracked=y,
+                                  lineage_name='lineages.json',
+                                  compression=compression)
+
+            # compression is detected when loading
+            loaded = utils.load_trks(filename)
+            assert loaded['lineages'] == lineage
+            np.testing.assert_array_equal(X, loaded['X'])
+            np.testing.assert_array_equal(y, loaded['y'])
+
+        with pytest.raises(ValueError):
+            utils.save_track_data(filename=os.path.join(str(tmpdir), 'x.trks'),
+                                  lineages=lineage,
+                                  raw=X,
+                                  tracked=y,
+                                  lineage_name='lineages.json',
+                                  compression='zip')
+
+    def test_load_trks_mmap(self, tmpdir):
+        X = get_image(30, 30)
+        y = np.random.randint(low=0, high=10, size=X.shape)
+        lineage = [dict()]
+
+        # uncompressed files on disk are memory-mapped
+        filename = os.path.join(str(tmpdir), 'x.trks')
+        utils.save_trks(filename, lineage, X, y)
+        loaded = utils.load_trks(filename, mmap_mode='r')
+        assert isinstance(loaded['X'], np.memmap)
+        assert isinstance(loaded['y'], np.memmap)
+        assert loaded['lineages'] == lineage
+        np.testing.assert_array_equal(X, loaded['X'])
+        np.testing.assert_array_equal(y, loaded['y'])
+
+        # copy-on-write memmaps don't modify the file
+        loaded = utils.load_trks(filename, mmap_mode='c')
+        loaded['X'][:] = 0
+        np.testing.assert_array_equal(X, utils.load_trks(filename)['X'])
+
+        # writable modes would modify the trk file
+        size = os.path.getsize(filename)
+        for mmap_mode in ('r+', 'w+', 'readwrite'):
+            with pytest.raises(ValueError):
+                utils.load_trks(filename, mmap_mode=mmap_mode)
+        assert os.path.getsize(filename) == size
+
+        # compressed files are loaded into memory
+        filename = os.path.join(str(tmpdir), 'x-gz.trks')
+        utils.save_trks(filename, lineage, X, y, compression='gz')
+        loaded = utils.load_trks(filename, mmap_mode='r')
+        assert not isinstance(loaded['X'], np.memmap)
+        np.testing.assert_array_equal(X, loaded['X'])
+        np.testing.assert_array_equal(y, loaded['y'])
+
+        # BytesIO objects are loaded into memory
+        b = io.BytesIO()
+        utils.save_trks(b, lineage, X, y)
+        b.seek(0)
+        loaded = utils.load_trks(b, mmap_mode='r')
+        assert not isinstance(loaded['X'], np.memmap)
+        np.testing.assert_array_equal(X, loaded['X'])
+        np.testing.assert_array_equal(y, loaded['y'])
+
+    def test_trk_folder_to_trks(self, tmpdir):
+        dirname = os.path.join(str(tmpdir), 'trks')
+        os.makedirs(dirname)
+
+        # filenames should be sorted naturally, not lexicographically
+        num_files = 11
+        for i in range(num_files):
+            X = np.full((1, 30, 30, 1), i)
+            y = np.zeros(X.shape, dtype='int32')
+            lineage = {i + 1: {'frames': [], 'parent': None,
+                               'daughters': [], 'label': i + 1}}
+            filename = os.path.join(dirname, 'movie{}.trk'.format(i))
+            utils.save_trk(filename, lineage, X, y)
+
+        # load files serially and with a thread pool
+        for num_workers in (None, 2):
+            utils.trk_folder_to_trks(dirname, 'all.trks', num_workers=num_workers)
+
+            loaded = utils.load_trks(os.path.join(str(tmpdir), 'all.trks'))
+            assert len(loaded['lineages']) == num_files
+            for i in range(num_files):
+                assert list(loaded['lineages'][i]) == [i + 1]
+                np.testing.assert_array_equal(loaded['X'][i], i)
+
     def test_load_trks(self, tmpdir):
         filename = os.path.join(str(tmpdir), 'bad-lineage.trk')
         X = get_image(30, 30)
@@ -230,8 +420,7 @@ class TestTrackingUtils(object):
             adj[:, i, i] = 1
 
         normalized = utils.normalize_adj_matrix(adj)
-
-        # TODO: check accuracy of normalized tensor.
+        assert normalized.dtype == np.float32
 
         # also normalize batches
         batched_adj = np.stack([adj, adj], axis=0)
@@ -243,6 +432,13 @@ class TestTrackingUtils(object):
                 batched_normalized[b],
                 normalized)
 
+        # normalized[i, j] == adj[i, j] / sqrt(degree[i] * degree[j])
+        adj[:, 0, 1] = 1
+        normalized = utils.normalize_adj_matrix(adj, epsilon=0)
+        expected = np.array([[1, 1 / np.sqrt(2)], [0, 1 / 2]])
+        for frame in range(frames):
+            np.testing.assert_allclose(normalized[frame], expected, rtol=1e-6)
+
         # Should fail with too large inputs
         with pytest.raises(ValueError):
             utils.normalize_adj_matrix(np.zeros((32,) * 2))
@@ -324,6 +520,13 @@ class TestTrackingUtils(object):
             assert new_lineage[d]['label'] == d
             assert not new_lineage[d]['daughters']
 
+        # daughters missing from the movie are dropped with a warning
+        bad_lineage = copy.deepcopy(lineage)
+        bad_lineage[parent_label]['daughters'].append(np.max(movie) + 1)
+        with pytest.warns(UserWarning):
+            _, new_lineage = utils.relabel_sequential_lineage(movie, bad_lineage)
+        assert len(new_lineage[new_parent_label]['daughters']) == 2
+
     def test_is_valid_lineage(self):
         image1 = get_annotated_image(num_labels=1, sequential=False)
         image2 = get_annotated_image(num_labels=2, sequential=False)
@@ -355,6 +558,9 @@ class TestTrackingUtils(object):
 
         assert utils.is_valid_lineage(movie, lineage)
 
+        # integer valued float labels are supported
+        assert utils.is_valid_lineage(movie.astype('float32'), lineage)
+
         # a cell's frames should match the label array
         bad_lineage = copy.deepcopy(lineage)
         bad_lineage[parent_label]['frames'].append(1)
@@ -409,7 +615,8 @@ class TestTrackingUtils(object):
 
         appearance_dim = 16
         distance_threshold = 64
-        features = utils.get_image_features(X, y, appearance_dim)
+        features = utils.get_image_features(X, y, appearance_dim,
+                                            distance_threshold)
 
         # test appearance
         appearances = features['appearances']
@@ -437,7 +644,59 @@ class TestTrackingUtils(object):
         assert labels.shape == expected_shape
         np.testing.assert_array_equal(labels, np.array(list(range(1, num_labels + 1))))
 
-    def test_trks_stats(self):
+        # test adjacency matrix
+        adj_matrix = features['adj_matrix']
+        expected_shape = (num_labels, num_labels)
+        assert adj_matrix.shape == expected_shape
+        np.testing.assert_array_equal(
+            adj_matrix,
+            utils.get_adjacency_matrix(centroids, distance_threshold))
+
+        # adjacency matrix is skipped without a distance threshold
+        features = utils.get_image_features(X, y, appearance_dim)
+        assert 'adj_matrix' not in features
+
+        # unsigned labels
+        uint_features = utils.get_image_features(X, y.astype('uint64'),
+                                                 appearance_dim)
+        for k in features:
+            np.testing.assert_array_equal(uint_features[k], features[k])
+
+    def test_get_adjacency_matrix(self):
+        distance_threshold = 10
+        centroids = np.array([[0, 0], [0, 5], [0, 20]], dtype='float32')
+        adj_matrix = utils.get_adjacency_matrix(centroids, distance_threshold)
+        expected = np.array([[1, 1, 0], [1, 1, 0], [0, 0, 1]])
+        np.testing.assert_array_equal(adj_matrix, expected)
+        assert adj_matrix.dtype == np.float32
+
+        # many objects are compared using the matmul identity
+        centroids = np.random.random((2500, 2)) * 1000
+        adj_matrix = utils.get_adjacency_matrix(centroids, distance_threshold)
+        diff = centroids[:, np.newaxis] - centroids[np.newaxis, :]
+        expected = np.sqrt(np.sum(diff ** 2, axis=-1)) < distance_threshold
+        np.testing.assert_array_equal(adj_matrix, expected)
+
+    def test_trks_stats(self, tmpdir, capsys):
+        data = get_dummy_data()
+        # JSON can't serialize the numpy labels of the dummy lineages
+        lineages = []
+        for b in range(data['y'].shape[0]):
+            lineages.append({
+                int(label): {
+                    'frames': tracks['frames'],
+                    'parent': tracks['parent'],
+                    'daughters': tracks['daughters'],
+                    'label': int(label),
+                } for label, tracks in data['lineages'][b].items()
+            })
+        filename = os.path.join(str(tmpdir), 'x.trks')
+        utils.save_trks(filename, lineages, data['X'], data['y'])
+
+        utils.trks_stats(filename)
+        captured = capsys.readouterr()
+        assert 'Total number of unique tracks (cells)' in captured.out
+
         # Test bad extension
         with pytest.raises(ValueError):
             utils.trks_stats('bad-extension.npz')
@@ -61,7 +61,7 @@ setup(name=NAME,
                         'pandas',
                         'pathlib2',
                         'scipy',
-                        'scikit-image>=0.14.5',
+                        'scikit-image>=0.16.0',
                         'deepcell-toolbox~=0.10.0'],
       extras_require={
           'tests': ['pytest<6',